@@ -1,16 +1,22 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, insert, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
 import pandas as pd
+import numpy as np
+import orjson
 import io
-import math
+import re
 from datetime import date
 from typing import List, Optional
 from pydantic import BaseModel
 
-from models import SessionLocal, Asset, Transaction, PriceHistory, init_db
+from models import AsyncSessionLocal, Asset, Transaction, PriceHistory, init_db
 from sync import sync_asset_data
-from portfolio import get_portfolio_allocation, calculate_equity_curve
+from portfolio import get_portfolio_allocation, calculate_equity_curve, invalidate_portfolio_cache
 
 # Pydantic models for request validation
 class TransactionCreate(BaseModel):
@@ -33,38 +39,45 @@ class TransactionUpdate(BaseModel):
 
 app = FastAPI(title="TradeWise API - 智慧投资追踪系统")
 
-def get_db():
-    db = SessionLocal()
+def parse_date(value: str) -> date:
+    """Parse a request date; ISO strings skip the pandas parser."""
     try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return pd.to_datetime(value).date()
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 @app.get("/debug/transactions")
-def debug_transactions(db: Session = Depends(get_db)):
-    """Debug endpoint to check transaction count"""
-    count = db.query(Transaction).count()
-    txs = db.query(Transaction).all()
+async def debug_transactions(limit: int = Query(100, ge=1, le=1000), db: AsyncSession = Depends(get_db)):
+    """Debug endpoint to check transaction count (lists the first `limit` transactions)"""
+    count = await db.scalar(select(func.count(Transaction.id)))
+    txs = (await db.execute(
+        select(Transaction.id, Transaction.asset_id, Transaction.date, Transaction.type, Transaction.quantity)
+        .order_by(Transaction.id).limit(limit))).mappings().all()
     return {
         "count": count,
-        "transactions": [{"id": t.id, "asset_id": t.asset_id, "date": str(t.date), "type": t.type, "quantity": t.quantity} for t in txs]
+        "transactions": [dict(t) for t in txs]
     }
 
 @app.get("/transactions")
-def get_transactions(symbol: Optional[str] = None, db: Session = Depends(get_db)):
+async def get_transactions(symbol: Optional[str] = None, db: AsyncSession = Depends(get_db)):
     """Get all transactions with asset information, optionally filter by symbol"""
-    query = db.query(Transaction).join(Asset)
+    # contains_eager fills t.asset from the same JOIN (joinedload would join assets a second time)
+    query = select(Transaction).join(Transaction.asset).options(contains_eager(Transaction.asset))
     
     if symbol:
-        query = query.filter(Asset.symbol == symbol)
+        query = query.where(Asset.symbol == symbol)
     
-    txs = query.order_by(Transaction.date.desc()).all()
+    txs = (await db.execute(query.order_by(Transaction.date.desc()))).scalars().all()
     return [
         {
             "id": t.id,
             "symbol": t.asset.symbol,
             "name": t.asset.name,
-            "date": str(t.date),
+            "date": t.date,
             "type": t.type,
             "quantity": t.quantity,
             "price": t.price,
@@ -75,18 +88,18 @@ def get_transactions(symbol: Optional[str] = None, db: Session = Depends(get_db)
     ]
 
 @app.post("/transactions")
-def create_transaction(tx: TransactionCreate, db: Session = Depends(get_db)):
+async def create_transaction(tx: TransactionCreate, db: AsyncSession = Depends(get_db)):
     """Create a new transaction manually"""
     # Ensure asset exists
-    asset = db.query(Asset).filter(Asset.symbol == tx.symbol).first()
+    asset = await db.scalar(select(Asset).where(Asset.symbol == tx.symbol))
     if not asset:
         asset = Asset(symbol=tx.symbol, name='', asset_type='stock')
         db.add(asset)
-        db.commit()
-        db.refresh(asset)
+        await db.commit()
+        await db.refresh(asset)
     
     # Parse date
-    tx_date = pd.to_datetime(tx.date).date()
+    tx_date = parse_date(tx.date)
     
     new_tx = Transaction(
         asset_id=asset.id,
@@ -98,14 +111,15 @@ def create_transaction(tx: TransactionCreate, db: Session = Depends(get_db)):
         notes=tx.notes
     )
     db.add(new_tx)
-    db.commit()
-    db.refresh(new_tx)
+    await db.commit()
+    await db.refresh(new_tx)
+    invalidate_portfolio_cache()
     
     return {
         "id": new_tx.id,
         "symbol": asset.symbol,
         "name": asset.name,
-        "date": str(new_tx.date),
+        "date": new_tx.date,
         "type": new_tx.type,
         "quantity": new_tx.quantity,
         "price": new_tx.price,
@@ -114,25 +128,25 @@ def create_transaction(tx: TransactionCreate, db: Session = Depends(get_db)):
     }
 
 @app.put("/transactions/{tx_id}")
-def update_transaction(tx_id: int, tx: TransactionUpdate, db: Session = Depends(get_db)):
+async def update_transaction(tx_id: int, tx: TransactionUpdate, db: AsyncSession = Depends(get_db)):
     """Update an existing transaction"""
-    existing_tx = db.query(Transaction).filter(Transaction.id == tx_id).first()
+    existing_tx = await db.get(Transaction, tx_id)
     if not existing_tx:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
     # Update asset if symbol changed
     if tx.symbol:
-        asset = db.query(Asset).filter(Asset.symbol == tx.symbol).first()
+        asset = await db.scalar(select(Asset).where(Asset.symbol == tx.symbol))
         if not asset:
             asset = Asset(symbol=tx.symbol, name='', asset_type='stock')
             db.add(asset)
-            db.commit()
-            db.refresh(asset)
+            await db.commit()
+            await db.refresh(asset)
         existing_tx.asset_id = asset.id
     
     # Update other fields
     if tx.date:
-        existing_tx.date = pd.to_datetime(tx.date).date()
+        existing_tx.date = parse_date(tx.date)
     if tx.type:
         existing_tx.type = tx.type
     if tx.quantity is not None:
@@ -144,14 +158,16 @@ def update_transaction(tx_id: int, tx: TransactionUpdate, db: Session = Depends(
     if tx.notes is not None:
         existing_tx.notes = tx.notes
     
-    db.commit()
-    db.refresh(existing_tx)
+    await db.commit()
+    await db.refresh(existing_tx)
+    invalidate_portfolio_cache()
+    asset = await db.get(Asset, existing_tx.asset_id)
     
     return {
         "id": existing_tx.id,
-        "symbol": existing_tx.asset.symbol,
-        "name": existing_tx.asset.name,
-        "date": str(existing_tx.date),
+        "symbol": asset.symbol,
+        "name": asset.name,
+        "date": existing_tx.date,
         "type": existing_tx.type,
         "quantity": existing_tx.quantity,
         "price": existing_tx.price,
@@ -160,24 +176,39 @@ def update_transaction(tx_id: int, tx: TransactionUpdate, db: Session = Depends(
     }
 
 @app.delete("/transactions/{tx_id}")
-def delete_transaction(tx_id: int, db: Session = Depends(get_db)):
+async def delete_transaction(tx_id: int, db: AsyncSession = Depends(get_db)):
     """Delete a transaction"""
-    tx = db.query(Transaction).filter(Transaction.id == tx_id).first()
+    tx = await db.get(Transaction, tx_id)
     if not tx:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
-    db.delete(tx)
-    db.commit()
+    await db.delete(tx)
+    await db.commit()
+    invalidate_portfolio_cache()
     
     return {"status": "success", "message": "Transaction deleted"}
 
-def safe_float(value: Optional[float]) -> Optional[float]:
-    """Convert float value to JSON-safe format (handle inf, -inf, nan)."""
-    if value is None:
-        return None
-    if math.isinf(value) or math.isnan(value):
-        return None
-    return value
+# K-line fields in response order; selected as plain columns so no ORM objects are built
+KLINE_COLUMNS = [
+    PriceHistory.date.label('time'),
+    PriceHistory.open, PriceHistory.high, PriceHistory.low, PriceHistory.close,
+    # 后复权数据
+    PriceHistory.adj_open, PriceHistory.adj_high, PriceHistory.adj_low, PriceHistory.adj_close,
+    # 前复权数据
+    PriceHistory.qfq_open, PriceHistory.qfq_high, PriceHistory.qfq_low, PriceHistory.qfq_close,
+    PriceHistory.volume,
+]
+
+async def load_kline(db: AsyncSession, asset_id: int) -> list:
+    """Load an asset's price history as K-line records (nan/inf become null in kline_response)."""
+    result = await db.execute(
+        select(*KLINE_COLUMNS).where(PriceHistory.asset_id == asset_id).order_by(PriceHistory.date))
+    return [dict(row) for row in result.mappings()]
+
+def kline_response(content: dict) -> Response:
+    """Encode a K-line payload with orjson: dates natively, nan/inf as null."""
+    return Response(orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY),
+                    media_type="application/json")
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -193,51 +224,42 @@ def startup_event():
     init_db()
 
 @app.get("/assets")
-def list_assets(db: Session = Depends(get_db)):
-    return db.query(Asset).all()
+async def list_assets(db: AsyncSession = Depends(get_db)):
+    return (await db.execute(select(Asset))).scalars().all()
 
-@app.post("/assets/sync/{symbol}")
-def sync_asset(symbol: str, asset_type: str = "stock", db: Session = Depends(get_db)):
-    sync_asset_data(symbol, asset_type)
+# The K-line endpoints return kline_response themselves: these payloads are our own
+# DB rows, so FastAPI's response validation and jsonable_encoder walk are skipped
+@app.post("/assets/sync/{symbol}", response_model=None)
+async def sync_asset(symbol: str, asset_type: str = "stock", db: AsyncSession = Depends(get_db)):
+    # akshare is blocking network I/O, keep it off the event loop
+    await run_in_threadpool(sync_asset_data, symbol, asset_type)
+    invalidate_portfolio_cache()
     
-    asset = db.query(Asset).filter(Asset.symbol == symbol).first()
+    asset = await db.scalar(select(Asset).where(Asset.symbol == symbol))
     if not asset:
         raise HTTPException(status_code=404, detail="Asset not found")
     
-    prices = db.query(PriceHistory).filter(PriceHistory.asset_id == asset.id).order_by(PriceHistory.date).all()
+    kline = await load_kline(db, asset.id)
     
-    return {
+    return kline_response({
         "status": "success",
         "message": f"Synced {symbol}",
         "data": {
             "symbol": symbol,
             "name": asset.name,
             "type": asset.asset_type,
-            "kline": [
-                {
-                    "time": str(p.date),
-                    "open": safe_float(p.open),
-                    "high": safe_float(p.high),
-                    "low": safe_float(p.low),
-                    "close": safe_float(p.close),
-                    # 后复权数据
-                    "adj_open": safe_float(p.adj_open),
-                    "adj_high": safe_float(p.adj_high),
-                    "adj_low": safe_float(p.adj_low),
-                    "adj_close": safe_float(p.adj_close),
-                    # 前复权数据
-                    "qfq_open": safe_float(p.qfq_open),
-                    "qfq_high": safe_float(p.qfq_high),
-                    "qfq_low": safe_float(p.qfq_low),
-                    "qfq_close": safe_float(p.qfq_close),
-                    "volume": safe_float(p.volume)
-                } for p in prices
-            ]
+            "kline": kline
         }
-    }
+    })
+
+# 导入文件的列类型：券商导出的证券代码按文本读取（之后仍补齐6位），业务类型用 category。
+# 标准CSV的 symbol 列保持原解析方式（000333 -> '333'），与已导入的资产代码一致，查重才能命中
+IMPORT_DTYPES = {'证券代码': str, 'type': 'category', '业务类型': 'category'}
+# Excel 导出的 ="..." 包裹格式
+QUOTED_CELL = re.compile(r'^="|"$')
 
 @app.post("/transactions/import")
-async def import_transactions(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def import_transactions(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
     """
     Import transactions from CSV or Excel file.
     Expected formats:
@@ -250,26 +272,27 @@ async def import_transactions(file: UploadFile = File(...), db: Session = Depend
     filename = file.filename.lower()
     
     # 根据文件类型读取
+    # 文本格式直接从字节流解析（C 引擎），不先解码成字符串
     if filename.endswith('.csv'):
         try:
-            df = pd.read_csv(io.StringIO(contents.decode('utf-8')))
-        except:
-            df = pd.read_csv(io.StringIO(contents.decode('gbk')))
+            df = pd.read_csv(io.BytesIO(contents), encoding='utf-8', dtype=IMPORT_DTYPES, engine='c')
+        except UnicodeDecodeError:
+            df = pd.read_csv(io.BytesIO(contents), encoding='gbk', dtype=IMPORT_DTYPES, engine='c')
     elif filename.endswith(('.xls', '.xlsx')):
         try:
             df = pd.read_excel(io.BytesIO(contents))
         except:
-            df = pd.read_csv(io.StringIO(contents.decode('gbk')), sep='\t')
+            # 部分券商导出的 .xls 实际是 GBK 编码的制表符分隔文本
+            df = pd.read_csv(io.BytesIO(contents), encoding='gbk', sep='\t', dtype=IMPORT_DTYPES, engine='c')
     else:
         raise HTTPException(status_code=400, detail="只支持 CSV 和 Excel 文件格式")
     
     # 处理带引号的列名（如 ="交割日期" -> 交割日期）
     if any('=' in str(col) for col in df.columns):
-        df.columns = df.columns.astype(str).str.replace(r'^="|"$', '', regex=True)
+        df.columns = df.columns.astype(str).str.replace(QUOTED_CELL, '', regex=True)
         # 同时清理数据中的引号格式（只清理字符串列，数字列保持不变）
-        for col in df.columns:
-            if df[col].dtype == 'object' or pd.api.types.is_string_dtype(df[col].dtype):
-                df[col] = df[col].astype(str).str.replace(r'^="|"$', '', regex=True)
+        str_cols = df.select_dtypes(include=['object', 'string']).columns
+        df[str_cols] = df[str_cols].apply(lambda s: s.astype(str).str.replace(QUOTED_CELL, '', regex=True))
     
     # 检测是否是券商交割单格式
     if '交割日期' in df.columns and '证券代码' in df.columns:
@@ -297,7 +320,7 @@ async def import_transactions(file: UploadFile = File(...), db: Session = Depend
             '过户费': 'fee'
         })
         # 处理业务类型: 证券买入->buy, 证券卖出->sell
-        df['type'] = df['type'].apply(lambda x: 'buy' if '买入' in str(x) else 'sell')
+        df['type'] = np.where(df['type'].str.contains('买入', na=False), 'buy', 'sell')
         # 计算总费用
         df['fees'] = df['comm'].fillna(0) + df['tax'].fillna(0) + df['fee'].fillna(0)
         df['symbol'] = df['symbol'].astype(str).str.zfill(6) # 补齐6位
@@ -318,59 +341,49 @@ async def import_transactions(file: UploadFile = File(...), db: Session = Depend
             'fees': 'fees'
         })
     
-    imported_count = 0
-    skipped_count = 0
-    
     # 初始化 filtered_count 变量（非交割单格式时为0）
     if 'filtered_count' not in locals():
         filtered_count = 0
     
-    for _, row in df.iterrows():
-        # Ensure asset exists
-        asset = db.query(Asset).filter(Asset.symbol == str(row['symbol'])).first()
-        if not asset:
-            # 获取证券名称
-            asset_name = str(row.get('asset_name', '')) if 'asset_name' in row else ''
-            asset = Asset(symbol=str(row['symbol']), name=asset_name, asset_type='stock')
-            db.add(asset)
-            db.commit()
-            db.refresh(asset)
-        
-        # 解析交易数据
-        tx_date = pd.to_datetime(row['date']).date()
-        tx_type = str(row['type'])
-        tx_quantity = float(row['quantity'])
-        tx_price = float(row['price'])
-        tx_fees = float(row.get('fees', 0.0))
-        
-        # 检查是否已存在完全相同的交易记录
-        existing = db.query(Transaction).filter(
-            Transaction.asset_id == asset.id,
-            Transaction.date == tx_date,
-            Transaction.type == tx_type,
-            Transaction.quantity == tx_quantity,
-            Transaction.price == tx_price,
-            Transaction.fees == tx_fees
-        ).first()
-        
-        if existing:
-            # 已存在，跳过
-            skipped_count += 1
-            continue
-        
-        # 不存在，插入新记录
-        tx = Transaction(
-            asset_id=asset.id,
-            date=tx_date,
-            type=tx_type,
-            quantity=tx_quantity,
-            price=tx_price,
-            fees=tx_fees
-        )
-        db.add(tx)
-        imported_count += 1
+    # 解析交易数据（整列转换，不逐行处理）
+    df['symbol'] = df['symbol'].astype(str)
+    df['date'] = pd.to_datetime(df['date']).dt.date
+    df['type'] = df['type'].astype(str)
+    df['quantity'] = df['quantity'].astype(float)
+    df['price'] = df['price'].astype(float)
+    df['fees'] = df['fees'].astype(float) if 'fees' in df.columns else 0.0
+    
+    # Ensure assets exist: one lookup for the whole file, then create the missing ones
+    symbols = df['symbol'].unique().tolist()
+    asset_ids = dict((await db.execute(select(Asset.symbol, Asset.id).where(Asset.symbol.in_(symbols)))).all())
+    new_assets = df.loc[~df['symbol'].isin(list(asset_ids)), ['symbol'] + (['asset_name'] if 'asset_name' in df.columns else [])].drop_duplicates('symbol')
+    if not new_assets.empty:
+        # 获取证券名称
+        names = new_assets['asset_name'].astype(str) if 'asset_name' in new_assets.columns else [''] * len(new_assets)
+        assets = [Asset(symbol=symbol, name=name, asset_type='stock') for symbol, name in zip(new_assets['symbol'], names)]
+        db.add_all(assets)
+        await db.flush()
+        asset_ids.update({asset.symbol: asset.id for asset in assets})
+    df['asset_id'] = df['symbol'].map(asset_ids)
     
-    db.commit()
+    # 检查是否已存在完全相同的交易记录（只载入本文件涉及资产的已有记录，集合查重）
+    existing = set((await db.execute(select(
+        Transaction.asset_id, Transaction.date, Transaction.type,
+        Transaction.quantity, Transaction.price, Transaction.fees
+    ).where(Transaction.asset_id.in_(list(asset_ids.values()))))).all())
+    key_cols = ['asset_id', 'date', 'type', 'quantity', 'price', 'fees']
+    keys = zip(*(df[col].tolist() for col in key_cols))
+    is_new = [key not in existing for key in keys]
+    
+    # 不存在的记录批量插入
+    records = df.loc[is_new, key_cols].to_dict('records')
+    if records:
+        await db.execute(insert(Transaction), records)
+    imported_count = len(records)
+    skipped_count = len(df) - imported_count
+    
+    await db.commit()
+    invalidate_portfolio_cache()
     
     result = {
         "status": "success",
@@ -391,58 +404,54 @@ async def import_transactions(file: UploadFile = File(...), db: Session = Depend
     return result
 
 @app.get("/portfolio/summary")
-def get_portfolio_summary(db: Session = Depends(get_db)):
-    return get_portfolio_allocation(db)
+async def get_portfolio_summary(db: AsyncSession = Depends(get_db)):
+    # portfolio.py works on a plain Session; run_sync hands it one
+    return await db.run_sync(get_portfolio_allocation)
 
 @app.get("/portfolio/equity-curve")
-def get_equity_curve(db: Session = Depends(get_db)):
-    return calculate_equity_curve(db)
+async def get_equity_curve(db: AsyncSession = Depends(get_db)):
+    return await db.run_sync(calculate_equity_curve)
 
 @app.get("/assets/with-transactions")
-def list_assets_with_transactions(db: Session = Depends(get_db)):
+async def list_assets_with_transactions(db: AsyncSession = Depends(get_db)):
     """
     Return only assets that have at least one transaction.
     """
     # Get all asset IDs that have transactions
-    asset_ids_with_tx = db.query(Transaction.asset_id).distinct().all()
+    asset_ids_with_tx = (await db.execute(select(Transaction.asset_id).distinct())).all()
     asset_ids = [id[0] for id in asset_ids_with_tx]
     
     # Get the actual assets
-    assets = db.query(Asset).filter(Asset.id.in_(asset_ids)).all()
+    assets = (await db.execute(select(Asset).where(Asset.id.in_(asset_ids)))).scalars().all()
     return assets
 
-@app.get("/charts/{symbol}")
-def get_chart_data(symbol: str, db: Session = Depends(get_db)):
-    asset = db.query(Asset).filter(Asset.symbol == symbol).first()
+@app.get("/charts/{symbol}", response_model=None)
+async def get_chart_data(symbol: str, db: AsyncSession = Depends(get_db)):
+    asset = await db.scalar(select(Asset).where(Asset.symbol == symbol))
     if not asset:
         raise HTTPException(status_code=404, detail="Asset not found")
     
-    prices = db.query(PriceHistory).filter(PriceHistory.asset_id == asset.id).order_by(PriceHistory.date).all()
-    txs = db.query(Transaction).filter(Transaction.asset_id == asset.id).all()
+    prices = await load_kline(db, asset.id)
+    result = await db.execute(
+        select(Transaction.date, Transaction.type, Transaction.quantity, Transaction.notes)
+        .where(Transaction.asset_id == asset.id))
+    txs = pd.DataFrame(result.all(), columns=list(result.keys()))
     
-    return {
-        "prices": [
-            {
-                "time": str(p.date),
-                "open": safe_float(p.open),
-                "high": safe_float(p.high),
-                "low": safe_float(p.low),
-                "close": safe_float(p.close),
-                # 后复权数据
-                "adj_open": safe_float(p.adj_open),
-                "adj_high": safe_float(p.adj_high),
-                "adj_low": safe_float(p.adj_low),
-                "adj_close": safe_float(p.adj_close),
-                # 前复权数据
-                "qfq_open": safe_float(p.qfq_open),
-                "qfq_high": safe_float(p.qfq_high),
-                "qfq_low": safe_float(p.qfq_low),
-                "qfq_close": safe_float(p.qfq_close),
-                "volume": safe_float(p.volume)
-            } for p in prices
-        ],
-        "markers": [{"time": str(t.date), "position": "belowBar" if t.type == "buy" else "aboveBar", "color": "red" if t.type == "buy" else "green", "shape": "arrowUp" if t.type == "buy" else "arrowDown", "text": f"{t.type} {t.quantity}", "notes": t.notes} for t in txs]
-    }
+    # 买卖点标记：买入红色向上箭头（K线下方），卖出绿色向下箭头（K线上方）
+    is_buy = (txs['type'] == 'buy').to_numpy()
+    markers = pd.DataFrame({
+        "time": txs['date'],
+        "position": np.where(is_buy, "belowBar", "aboveBar"),
+        "color": np.where(is_buy, "red", "green"),
+        "shape": np.where(is_buy, "arrowUp", "arrowDown"),
+        "text": txs['type'].astype(str) + ' ' + txs['quantity'].astype(str),
+        "notes": txs['notes'],
+    })
+    
+    return kline_response({
+        "prices": prices,
+        "markers": markers.to_dict('records')
+    })
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 Base = declarative_base()
 
@@ -38,6 +39,7 @@ class PriceHistory(Base):
 
     asset = relationship("Asset", back_populates="prices")
 
+    # The unique constraint doubles as the (asset_id, date) lookup index
     __table_args__ = (UniqueConstraint('asset_id', 'date', name='_asset_date_uc'),)
 
 class Transaction(Base):
@@ -53,10 +55,34 @@ class Transaction(Base):
 
     asset = relationship("Asset", back_populates="transactions")
 
+    __table_args__ = (Index('ix_tx_asset_date', 'asset_id', 'date'),)
+
 # Database setup
 DATABASE_URL = "sqlite:///./investments.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Pooled connections are reused across requests; a larger compiled-statement
+# cache keeps our repeated select()/insert() shapes from being recompiled
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, query_cache_size=1200)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Async engine for the API handlers (same database file, aiosqlite driver)
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./investments.db"
+async_engine = create_async_engine(ASYNC_DATABASE_URL, query_cache_size=1200)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run during imports/syncs; NORMAL only fsyncs at checkpoints
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-65536")  # 64 MiB page cache
+    cursor.close()
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all skips existing tables, so add indexes introduced after a DB was created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
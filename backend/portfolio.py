@@ -1,52 +1,89 @@
+from sqlalchemy import select, func
 from sqlalchemy.orm import Session
 from models import Transaction, PriceHistory, Asset
-from datetime import date
 import pandas as pd
-from collections import defaultdict
+import numpy as np
+import time
+
+# get_portfolio_allocation result cache: one entry keyed on the newest
+# transaction/price row ids, refreshed at least every _ALLOCATION_TTL seconds
+_ALLOCATION_TTL = 30
+_allocation_cache = {}
+
+def invalidate_portfolio_cache():
+    """
+    Drop the cached allocation after transactions or prices change.
+    """
+    _allocation_cache.clear()
 
 def calculate_portfolio_holdings(db: Session):
     """
     Calculate current holdings for each asset.
     """
-    txs = db.query(Transaction).all()
-    holdings = defaultdict(float)
-    for tx in txs:
-        asset = tx.asset
-        if tx.type == 'buy':
-            holdings[asset.symbol] += tx.quantity
-        elif tx.type == 'sell':
-            holdings[asset.symbol] -= tx.quantity
+    df = pd.read_sql(
+        select(Asset.symbol, Transaction.type, Transaction.quantity).join(Asset).order_by(Transaction.id),
+        db.connection())
+    sign = np.where(df['type'] == 'buy', 1.0, np.where(df['type'] == 'sell', -1.0, 0.0))
+    signed = sign * df['quantity'].to_numpy(dtype=np.float64)
+    # Integer codes per symbol (in first-seen order), summed in one bincount pass
+    codes, symbols = pd.factorize(df['symbol'])
+    totals = np.bincount(codes, weights=signed, minlength=len(symbols))
     
     # Filter out closed positions
-    return {s: q for s, q in holdings.items() if q > 0}
+    return {s: q for s, q in zip(symbols, totals.tolist()) if q > 0}
 
 def get_portfolio_allocation(db: Session):
     """
     Calculate current value and percentage for each asset.
+    Served from cache while no transaction or price row has been added.
     """
+    key = tuple(db.execute(select(
+        select(func.max(Transaction.id)).scalar_subquery(),
+        select(func.max(PriceHistory.id)).scalar_subquery(),
+    )).one())
+    cached = _allocation_cache.get(key)
+    if cached and time.monotonic() - cached[0] < _ALLOCATION_TTL:
+        return cached[1]
+    
+    allocation = _calculate_allocation(db)
+    _allocation_cache.clear()
+    _allocation_cache[key] = (time.monotonic(), allocation)
+    return allocation
+
+def _calculate_allocation(db: Session):
     holdings = calculate_portfolio_holdings(db)
     
     # 如果没有持仓，直接返回空
     if not holdings:
         return {"items": [], "total_value": 0}
     
+    # Latest close per held asset in one statement: MAX(date) per asset_id
+    # (served by the asset_id/date index) joined back to its price row
+    latest = (select(PriceHistory.asset_id, func.max(PriceHistory.date).label('date'))
+              .group_by(PriceHistory.asset_id)
+              .subquery())
+    rows = db.execute(
+        select(Asset.symbol, Asset.name, PriceHistory.close)
+        .outerjoin(latest, latest.c.asset_id == Asset.id)
+        .outerjoin(PriceHistory, (PriceHistory.asset_id == latest.c.asset_id) & (PriceHistory.date == latest.c.date))
+        .where(Asset.symbol.in_(list(holdings)))
+    ).all()
+    assets = {symbol: (name, close) for symbol, name, close in rows}
+    
     allocation = []
     total_value = 0
     
     for symbol, quantity in holdings.items():
-        asset = db.query(Asset).filter(Asset.symbol == symbol).first()
-        if not asset:
+        if symbol not in assets:
             continue
-            
-        # Get latest price
-        latest_price = db.query(PriceHistory).filter(PriceHistory.asset_id == asset.id).order_by(PriceHistory.date.desc()).first()
+        name, close = assets[symbol]
         
-        price = latest_price.close if latest_price else 0
+        price = close if close is not None else 0
         value = quantity * price
         total_value += value
         
         # 如果资产没有名称，使用symbol作为名称
-        asset_name = asset.name if asset.name and asset.name.strip() else symbol
+        asset_name = name if name and name.strip() else symbol
             
         allocation.append({
             "symbol": symbol,
@@ -66,51 +103,59 @@ def calculate_equity_curve(db: Session):
     """
     Calculate the total portfolio value over time.
     """
-    # This is a bit complex. We need to:
-    # 1. Get all dates where we had transactions or prices.
-    # 2. Iterate through dates, maintain a running balance of holdings.
-    # 3. Multiply holdings by prices on each date.
-    
-    txs = db.query(Transaction).order_by(Transaction.date).all()
-    if not txs:
+    # Load everything up front and let pandas do the walk:
+    # 1. Signed transaction quantities, accumulated into holdings per asset.
+    # 2. Close prices pivoted to dates x assets and forward filled, so a day
+    #    without a quote falls back to the most recent earlier close.
+    # 3. Daily value = sum over assets of holdings * price.
+    conn = db.connection()
+    txs = pd.read_sql(
+        select(Transaction.date, Transaction.asset_id, Transaction.type, Transaction.quantity),
+        conn, parse_dates=['date'])
+    if txs.empty:
         return []
     
-    start_date = txs[0].date
-    end_date = date.today()
+    start_date = txs['date'].min().date()
     
     # Get all price dates
-    price_dates = db.query(PriceHistory.date).distinct().filter(PriceHistory.date >= start_date).order_by(PriceHistory.date).all()
-    all_dates = [d[0] for d in price_dates]
+    price_dates = pd.read_sql(
+        select(PriceHistory.date).distinct().filter(PriceHistory.date >= start_date).order_by(PriceHistory.date),
+        conn, parse_dates=['date'])
+    all_dates = pd.DatetimeIndex(price_dates['date'])
+    if all_dates.empty:
+        return []
     
-    equity_curve = []
-    current_holdings = defaultdict(float)
-    tx_idx = 0
+    # Holdings after each transaction date, carried forward to every price date
+    signed = txs['quantity'].where(txs['type'] == 'buy', -txs['quantity'])
+    holdings = (signed.groupby([txs['date'], txs['asset_id']]).sum()
+                .unstack(fill_value=0)
+                .sort_index()
+                .cumsum()
+                .reindex(all_dates, method='ffill')
+                .fillna(0))
     
-    for d in all_dates:
-        # Update holdings with transactions on or before this date
-        while tx_idx < len(txs) and txs[tx_idx].date <= d:
-            t = txs[tx_idx]
-            asset_symbol = t.asset.symbol
-            if t.type == 'buy':
-                current_holdings[asset_symbol] += t.quantity
-            else:
-                current_holdings[asset_symbol] -= t.quantity
-            tx_idx += 1
-            
-        # Calculate daily value
-        daily_value = 0
-        for symbol, qty in current_holdings.items():
-            if qty == 0: continue
-            asset = db.query(Asset).filter(Asset.symbol == symbol).first()
-            p = db.query(PriceHistory).filter(PriceHistory.asset_id == asset.id, PriceHistory.date == d).first()
-            if p:
-                daily_value += qty * p.close
-            else:
-                # If no price for this exact date, try to find the most recent one before it
-                p_last = db.query(PriceHistory).filter(PriceHistory.asset_id == asset.id, PriceHistory.date < d).order_by(PriceHistory.date.desc()).first()
-                if p_last:
-                    daily_value += qty * p_last.close
-                    
-        equity_curve.append({"time": str(d), "value": daily_value})
-        
-    return equity_curve
+    # Prices for the traded assets only, including quotes before start_date
+    prices = pd.read_sql(
+        select(PriceHistory.date, PriceHistory.asset_id, PriceHistory.close)
+        .filter(PriceHistory.asset_id.in_(holdings.columns.tolist())),
+        conn, parse_dates=['date'])
+    closes = (prices.pivot(index='date', columns='asset_id', values='close')
+              .sort_index()
+              .ffill()
+              .reindex(all_dates, method='ffill')
+              .reindex(columns=holdings.columns)
+              .fillna(0))  # Assets without any price yet contribute nothing
+    
+    daily_values = _equity_values(holdings.to_numpy(dtype=np.float64), closes.to_numpy(dtype=np.float64))
+    
+    return [
+        {"time": t, "value": v}
+        for t, v in zip(all_dates.strftime('%Y-%m-%d'), daily_values.tolist())
+    ]
+
+def _equity_values(holdings: np.ndarray, closes: np.ndarray) -> np.ndarray:
+    """
+    Row-wise dot product of two aligned dates x assets matrices.
+    """
+    # einsum reduces in one pass without materialising the holdings * closes product
+    return np.einsum('ij,ij->i', holdings, closes)
@@ -1,10 +1,151 @@
 import akshare as ak
 import pandas as pd
 import numpy as np
-from datetime import datetime
-from typing import Optional
+import requests
+import sys
+import time
+import types
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from models import SessionLocal, Asset, PriceHistory, init_db
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36")
+
+def _install_session():
+    """
+    Route akshare's module-level requests.get/post through one pooled Session so
+    repeated calls to East Money/Tencent/Sina reuse keep-alive connections instead
+    of paying a TCP+TLS handshake each time.
+    Patched: the provider modules behind stock_zh_a_hist, stock_zh_a_hist_tx,
+    stock_zh_a_daily, fund_etf_hist_em, stock_individual_info_em and
+    fund_etf_spot_ths (each does `import requests` and calls requests.get).
+    fund_etf_spot_em is not covered: it pages through akshare.utils.func's
+    request_with_retry, which deliberately opens a fresh Session per request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32,
+                          max_retries=Retry(total=2, backoff_factor=0.3))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Browser-like UA for calls that send no headers of their own; per-call headers
+    # passed by akshare still take precedence
+    session.headers.update({"User-Agent": USER_AGENT})
+
+    # A copy of the requests module whose get/post use the session; only the
+    # akshare modules below see it, the real requests module is left untouched
+    pooled = types.ModuleType("requests")
+    pooled.__dict__.update(requests.__dict__)
+    pooled.get = session.get
+    pooled.post = session.post
+
+    for func in (ak.stock_zh_a_hist, ak.stock_zh_a_hist_tx, ak.stock_zh_a_daily,
+                 ak.fund_etf_hist_em, ak.stock_individual_info_em,
+                 ak.fund_etf_spot_ths):
+        module = sys.modules.get(func.__module__)
+        if getattr(module, "requests", None) is requests:
+            module.requests = pooled
+    return session
+
+_session = _install_session()
+
+# Start date for a full history fetch (new assets, or after an adjustment change)
+FULL_HISTORY_START = "20000101"
+
+# symbol -> (name or None, expiry); names rarely change, failed lookups are retried sooner
+_NAME_TTL = 7 * 86400
+_NAME_MISS_TTL = 3600
+_name_cache = {}
+
+# (function name, kwargs) -> (expiry, DataFrame). Every history request runs up to
+# today, so entries expire quickly: today's bar keeps changing during trading hours
+_RESPONSE_TTL = 300
+_response_cache = {}
+
+# akshare is blocking HTTP; the raw/qfq/hfq requests for one symbol are
+# independent, so they are issued together on this pool. It is shared by all
+# symbols being synced and so also caps in-flight provider requests (East Money
+# tolerates about 8 concurrent connections)
+_fetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="akshare")
+
+def fetch_concurrently(*calls):
+    """
+    Run (func, kwargs) akshare calls in parallel and return their results in order.
+    The first failing call's exception is re-raised.
+    """
+    futures = [_fetch_pool.submit(fetch_cached, func, **kwargs) for func, kwargs in calls]
+    return [future.result() for future in futures]
+
+def fetch_cached(func, **kwargs):
+    """
+    Call an akshare history function, reusing the response for identical arguments
+    fetched within the last _RESPONSE_TTL seconds (e.g. repeated syncs while debugging).
+    Only non-empty DataFrames are cached; callers must not modify them in place.
+    """
+    key = (func.__name__, tuple(sorted(kwargs.items())))
+    now = time.time()
+    cached = _response_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+    df = func(**kwargs)
+    if isinstance(df, pd.DataFrame) and not df.empty:
+        for stale in [k for k, (expiry, _) in list(_response_cache.items()) if expiry <= now]:
+            _response_cache.pop(stale, None)
+        _response_cache[key] = (now + _RESPONSE_TTL, df)
+    return df
+
+def invalidate_fetch_cache(symbol: str):
+    """Drop cached responses for a symbol (Tencent/Sina keys carry an sh/sz prefix)."""
+    for key in list(_response_cache):
+        if str(dict(key[1]).get('symbol', '')).endswith(symbol):
+            _response_cache.pop(key, None)
+
+# Provider column -> PriceHistory column, per source and adjustment
+# (East Money stock/fund history, Tencent, Sina); the date column is parsed separately
+EM_RAW_COLUMNS = {'开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low', '成交量': 'volume'}
+EM_QFQ_COLUMNS = {'开盘': 'qfq_open', '收盘': 'qfq_close', '最高': 'qfq_high', '最低': 'qfq_low'}
+EM_HFQ_COLUMNS = {'开盘': 'adj_open', '收盘': 'adj_close', '最高': 'adj_high', '最低': 'adj_low'}
+FUND_RAW_COLUMNS = {'开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low'}
+FUND_QFQ_COLUMNS = {**EM_QFQ_COLUMNS, '成交量': 'volume'}
+TX_QFQ_COLUMNS = {'open': 'qfq_open', 'close': 'qfq_close', 'high': 'qfq_high', 'low': 'qfq_low', 'amount': 'amount'}
+TX_HFQ_COLUMNS = {'open': 'adj_open', 'close': 'adj_close', 'high': 'adj_high', 'low': 'adj_low'}
+SINA_COLUMNS = {'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close', 'volume': 'volume'}
+DATE_FORMAT = '%Y-%m-%d'
+
+def select_columns(df: pd.DataFrame, date_col: str, columns: Dict[str, str]) -> pd.DataFrame:
+    """
+    Pick and rename a provider frame's columns, with its date column parsed into 'date'.
+    """
+    out = df[list(columns)].rename(columns=columns)
+    out.insert(0, 'date', pd.to_datetime(df[date_col], format=DATE_FORMAT))
+    return out
+
+# The date alignment below is the only real join here. Lookup-style enrichment
+# (symbol -> asset id, name, sector...) should use Series.map with a dict or an
+# indexed Series, as the import endpoint does for asset ids, not pd.merge
+def join_on_date(*frames: pd.DataFrame) -> pd.DataFrame:
+    """
+    Outer-join price frames on their 'date' column.
+    The frames are aligned on a shared date index with one concat rather than
+    chained pd.merge hash joins; dates must be unique within each frame.
+    Each index is sorted first (akshare already returns ascending dates, so this
+    is usually a no-op) so the alignment takes the monotonic merge-join path.
+    """
+    indexed = [frame.set_index('date').sort_index() for frame in frames]
+    if not all(frame.index.is_unique for frame in indexed):
+        raise Exception("Duplicate dates in price data")
+    # Dates outside the range every frame covers would carry NaN prices and be
+    # dropped by validate_price_data anyway, so clip them before aligning
+    lo = max(frame.index[0] for frame in indexed)
+    hi = min(frame.index[-1] for frame in indexed)
+    indexed = [frame.loc[lo:hi] for frame in indexed]
+    return pd.concat(indexed, axis=1, join='outer').reset_index()
 
 def validate_price_data(df: pd.DataFrame, source: str) -> pd.DataFrame:
     """
@@ -21,19 +162,18 @@ def validate_price_data(df: pd.DataFrame, source: str) -> pd.DataFrame:
                   'qfq_open', 'qfq_high', 'qfq_low', 'qfq_close',
                   'adj_open', 'adj_high', 'adj_low', 'adj_close']
 
-    for col in price_cols:
-        if col in df.columns:
-            # Remove rows with negative or zero prices (adjusted prices must be > 0)
-            df = df[df[col] > 0]
-            # Remove rows with NaN or inf
-            df = df[df[col].notna()]
-            df = df[~np.isinf(df[col])]
+    # One boolean mask over the underlying arrays instead of re-slicing per check
+    present = [col for col in price_cols if col in df.columns]
+    prices = df[present].to_numpy(dtype=float)
+    # Prices must be finite and > 0 (adjusted prices included)
+    mask = (np.isfinite(prices) & (prices > 0)).all(axis=1)
 
     # Check volume if present (volume can be 0 but not negative)
     if 'volume' in df.columns:
-        df = df[df['volume'] >= 0]
-        df = df[df['volume'].notna()]
-        df = df[~np.isinf(df['volume'])]
+        volume = df['volume'].to_numpy(dtype=float)
+        mask &= np.isfinite(volume) & (volume >= 0)
+
+    df = df.loc[mask]
 
     removed_count = original_count - len(df)
     if removed_count > 0:
@@ -41,137 +181,160 @@ def validate_price_data(df: pd.DataFrame, source: str) -> pd.DataFrame:
 
     return df
 
+def _exchange_prefix(symbol: str) -> str:
+    return "sz" if symbol.startswith("0") or symbol.startswith("3") else "sh"
+
+def adjust_with_factor(df_raw: pd.DataFrame, factors: pd.DataFrame) -> pd.DataFrame:
+    """
+    Derive qfq/hfq prices from raw prices and Sina's hfq factor series.
+    factors holds one row per adjustment event ('date', 'hfq_factor'); each trading
+    day uses the last factor on or before it. hfq = raw * factor, and
+    qfq = raw * factor / latest factor (anchored to the current price).
+    """
+    factor = pd.Series(factors['hfq_factor'].astype(float).to_numpy(),
+                       index=pd.to_datetime(factors['date'])).sort_index()
+    if factor.empty:
+        raise Exception("Empty hfq factor series")
+    pos = factor.index.searchsorted(df_raw['date'], side='right') - 1
+    if (pos < 0).any():
+        raise Exception("hfq factor series starts after the price data")
+    hfq = factor.to_numpy()[pos]
+    qfq = hfq / factor.iloc[-1]
+
+    df = df_raw.copy()
+    for col in ('open', 'close', 'high', 'low'):
+        # Rounded to cents like the provider-adjusted series
+        df[f'qfq_{col}'] = (df[col] * qfq).round(2)
+        df[f'adj_{col}'] = (df[col] * hfq).round(2)
+    return df
+
+def _fetch_em(symbol: str, start_date: str) -> pd.DataFrame:
+    """
+    East Money: raw, qfq and hfq (full data).
+    qfq/hfq are computed from Sina's adjustment factors, so only two requests are
+    made; the separate qfq/hfq history requests are the fallback.
+    """
+    raw_call = (ak.stock_zh_a_hist, dict(symbol=symbol, period="daily", start_date=start_date, adjust="", timeout=30))
+    raw_future = _fetch_pool.submit(fetch_cached, raw_call[0], **raw_call[1])
+    factor_future = _fetch_pool.submit(fetch_cached, ak.stock_zh_a_daily,
+                                       symbol=f"{_exchange_prefix(symbol)}{symbol}", adjust="hfq-factor")
+    # Raw data (not adjusted)
+    df_raw = raw_future.result()
+    if df_raw is None or df_raw.empty:
+        raise Exception("East Money returned empty raw data")
+    df_raw = select_columns(df_raw, '日期', EM_RAW_COLUMNS)
+
+    try:
+        return adjust_with_factor(df_raw, factor_future.result())
+    except Exception as e:
+        print(f"  Adjustment factors unavailable ({str(e)}), fetching qfq/hfq from East Money")
+
+    df_qfq, df_hfq = fetch_concurrently(
+        (ak.stock_zh_a_hist, dict(raw_call[1], adjust="qfq")),
+        (ak.stock_zh_a_hist, dict(raw_call[1], adjust="hfq")),
+    )
+
+    # 前复权数据 (qfq)
+    if df_qfq is None or df_qfq.empty:
+        raise Exception("East Money returned empty qfq data")
+    df_qfq = select_columns(df_qfq, '日期', EM_QFQ_COLUMNS)
+
+    # 后复权数据 (hfq)
+    if df_hfq is None or df_hfq.empty:
+        raise Exception("East Money returned empty hfq data")
+    df_hfq = select_columns(df_hfq, '日期', EM_HFQ_COLUMNS)
+
+    # Merge all data using outer join to avoid data loss
+    df = join_on_date(df_raw, df_qfq, df_hfq)
+
+    # Check if merged data is empty
+    if df.empty:
+        raise Exception("Merged data is empty after joining raw, qfq and hfq data")
+    return df
+
+def _fetch_tx(symbol: str, start_date: str) -> pd.DataFrame:
+    """Tencent: qfq and hfq only, volume estimated from amount."""
+    prefixed = f"{_exchange_prefix(symbol)}{symbol}"
+    df_qfq, df_hfq = fetch_concurrently(
+        (ak.stock_zh_a_hist_tx, dict(symbol=prefixed, start_date=start_date, end_date="20301231", adjust="qfq")),
+        (ak.stock_zh_a_hist_tx, dict(symbol=prefixed, start_date=start_date, end_date="20301231", adjust="hfq")),
+    )
+
+    # 前复权数据
+    if df_qfq is None or df_qfq.empty:
+        raise Exception("Tencent returned empty qfq data")
+    df_qfq = select_columns(df_qfq, 'date', TX_QFQ_COLUMNS)
+
+    # 后复权数据
+    if df_hfq is None or df_hfq.empty:
+        raise Exception("Tencent returned empty hfq data")
+    df_hfq = select_columns(df_hfq, 'date', TX_HFQ_COLUMNS)
+
+    # 合并数据使用outer join
+    df = join_on_date(df_qfq, df_hfq)
+
+    if df.empty:
+        raise Exception("Merged data is empty after joining qfq and hfq data")
+
+    # Copy qfq to raw columns (Tencent only has adj data)
+    df['open'] = df['qfq_open']
+    df['close'] = df['qfq_close']
+    df['high'] = df['qfq_high']
+    df['low'] = df['qfq_low']
+
+    # Estimate volume from amount (amount = price * volume * 100)
+    df['volume'] = (df['amount'] / df['qfq_close'] / 100).fillna(0)
+    return df.drop(columns=['amount'])
+
+def _fetch_sina(symbol: str, start_date: str) -> pd.DataFrame:
+    """Sina: raw data only."""
+    df = fetch_cached(ak.stock_zh_a_daily, symbol=f"{_exchange_prefix(symbol)}{symbol}",
+                      start_date=start_date, end_date="20301231")
+    if df is None or df.empty:
+        raise Exception("Sina returned empty data")
+    df = select_columns(df, 'date', SINA_COLUMNS)
+    # Sina 只有原始数据，前复权和后复权都用原始数据填充
+    df['qfq_open'] = df['open']
+    df['qfq_high'] = df['high']
+    df['qfq_low'] = df['low']
+    df['qfq_close'] = df['close']
+    df['adj_open'] = df['open']
+    df['adj_high'] = df['high']
+    df['adj_low'] = df['low']
+    df['adj_close'] = df['close']
+    return df
+
+# Stock data sources in priority order; each fetcher raises on empty data.
+# Transient HTTP errors are already retried by the pooled session's adapter
+STOCK_PROVIDERS = [
+    ("East Money", _fetch_em),
+    ("Tencent", _fetch_tx),
+    ("Sina", _fetch_sina),
+]
+
 def get_stock_data(symbol: str, start_date: str = "20000101", name: Optional[str] = None):
     """
     Fetch historical data for A-shares with consistent format.
     Priority: East Money (full data) -> Tencent (adj data) -> Sina (raw data)
     """
     print(f"Fetching data for Stock: {symbol} from {start_date}")
-    
-    # Try East Money first (has both raw and adjusted data)
-    try:
-        print("  Trying East Money...")
-        # Raw data (not adjusted)
-        df_raw = ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start_date, adjust="", timeout=30)
-        if df_raw is None or df_raw.empty:
-            raise Exception("East Money returned empty raw data")
-        df_raw['date'] = pd.to_datetime(df_raw['日期']).dt.date
-        df_raw = df_raw[['date', '开盘', '收盘', '最高', '最低', '成交量']]
-        df_raw.columns = ['date', 'open', 'close', 'high', 'low', 'volume']
-
-        # 前复权数据 (qfq)
-        df_qfq = ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start_date, adjust="qfq", timeout=30)
-        if df_qfq is None or df_qfq.empty:
-            raise Exception("East Money returned empty qfq data")
-        df_qfq['date'] = pd.to_datetime(df_qfq['日期']).dt.date
-        df_qfq = df_qfq[['date', '开盘', '收盘', '最高', '最低']]
-        df_qfq.columns = ['date', 'qfq_open', 'qfq_close', 'qfq_high', 'qfq_low']
-
-        # 后复权数据 (hfq)
-        df_hfq = ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start_date, adjust="hfq", timeout=30)
-        if df_hfq is None or df_hfq.empty:
-            raise Exception("East Money returned empty hfq data")
-        df_hfq['date'] = pd.to_datetime(df_hfq['日期']).dt.date
-        df_hfq = df_hfq[['date', '开盘', '收盘', '最高', '最低']]
-        df_hfq.columns = ['date', 'adj_open', 'adj_close', 'adj_high', 'adj_low']
-
-        # Merge all data using outer join to avoid data loss
-        df = pd.merge(df_raw, df_qfq, on='date', how='outer')
-        df = pd.merge(df, df_hfq, on='date', how='outer')
-
-        # Check if merged data is empty
-        if df.empty:
-            raise Exception("Merged data is empty after joining raw, qfq and hfq data")
-
-        # Validate data before returning
-        df = validate_price_data(df, "East Money")
-
-        if df.empty:
-            raise Exception("All data was filtered out as invalid")
-
-        print(f"  East Money success! Got {len(df)} records")
-        return df
-    except Exception as e:
-        print(f"  East Money failed: {str(e)}")
-        
-    # Try Tencent (has adjusted data but no volume)
-    try:
-        print("  Trying Tencent...")
-        prefix = "sz" if symbol.startswith("0") or symbol.startswith("3") else "sh"
-
-        # 前复权数据
-        df_qfq = ak.stock_zh_a_hist_tx(symbol=f"{prefix}{symbol}", start_date=start_date, end_date="20301231", adjust="qfq")
-        if df_qfq is None or df_qfq.empty:
-            raise Exception("Tencent returned empty qfq data")
-        df_qfq['date'] = pd.to_datetime(df_qfq['date']).dt.date
-        df_qfq = df_qfq[['date', 'open', 'close', 'high', 'low', 'amount']]
-        df_qfq.columns = ['date', 'qfq_open', 'qfq_close', 'qfq_high', 'qfq_low', 'amount']
-
-        # 后复权数据
-        df_hfq = ak.stock_zh_a_hist_tx(symbol=f"{prefix}{symbol}", start_date=start_date, end_date="20301231", adjust="hfq")
-        if df_hfq is None or df_hfq.empty:
-            raise Exception("Tencent returned empty hfq data")
-        df_hfq['date'] = pd.to_datetime(df_hfq['date']).dt.date
-        df_hfq = df_hfq[['date', 'open', 'close', 'high', 'low']]
-        df_hfq.columns = ['date', 'adj_open', 'adj_close', 'adj_high', 'adj_low']
-
-        # 合并数据使用outer join
-        df = pd.merge(df_qfq, df_hfq, on='date', how='outer')
-
-        if df.empty:
-            raise Exception("Merged data is empty after joining qfq and hfq data")
-
-        # Copy qfq to raw columns (Tencent only has adj data)
-        df['open'] = df['qfq_open']
-        df['close'] = df['qfq_close']
-        df['high'] = df['qfq_high']
-        df['low'] = df['qfq_low']
-
-        # Estimate volume from amount (amount = price * volume * 100)
-        df['volume'] = (df['amount'] / df['qfq_close'] / 100).fillna(0)
-        df = df.drop(columns=['amount'])
-
-        # Validate data before returning
-        df = validate_price_data(df, "Tencent")
-
-        if df.empty:
-            raise Exception("All Tencent data was filtered out as invalid")
-
-        print(f"  Tencent success! Got {len(df)} records")
-        return df
-    except Exception as e:
-        print(f"  Tencent failed: {str(e)}")
-        
-    # Fall back to Sina (only has raw data)
-    try:
-        print("  Trying Sina...")
-        prefix = "sz" if symbol.startswith("0") or symbol.startswith("3") else "sh"
-        df = ak.stock_zh_a_daily(symbol=f"{prefix}{symbol}", start_date=start_date, end_date="20301231")
-        if df is None or df.empty:
-            raise Exception("Sina returned empty data")
-        df['date'] = pd.to_datetime(df['date']).dt.date
-        df = df[['date', 'open', 'high', 'low', 'close', 'volume']]
-        # Sina 只有原始数据，前复权和后复权都用原始数据填充
-        df['qfq_open'] = df['open']
-        df['qfq_high'] = df['high']
-        df['qfq_low'] = df['low']
-        df['qfq_close'] = df['close']
-        df['adj_open'] = df['open']
-        df['adj_high'] = df['high']
-        df['adj_low'] = df['low']
-        df['adj_close'] = df['close']
-
-        # Validate data before returning
-        df = validate_price_data(df, "Sina")
-
-        if df.empty:
-            raise Exception("All Sina data was filtered out as invalid")
-
-        print(f"  Sina success! Got {len(df)} records")
-        return df
-    except Exception as e:
-        print(f"  Sina failed: {str(e)}")
-        raise Exception(f"All data sources failed for {symbol}: {str(e)}")
+
+    error = None
+    for source, fetch in STOCK_PROVIDERS:
+        try:
+            print(f"  Trying {source}...")
+            # Validate data before returning
+            df = validate_price_data(fetch(symbol, start_date), source)
+
+            if df.empty:
+                raise Exception(f"All {source} data was filtered out as invalid")
+
+            print(f"  {source} success! Got {len(df)} records")
+            return df
+        except Exception as e:
+            print(f"  {source} failed: {str(e)}")
+            error = e
+    raise Exception(f"All data sources failed for {symbol}: {str(error)}")
 
 def get_fund_data(symbol: str, start_date: str = "20000101", name: Optional[str] = None):
     """
@@ -179,33 +342,28 @@ def get_fund_data(symbol: str, start_date: str = "20000101", name: Optional[str]
     """
     print(f"Fetching data for Fund: {symbol} from {start_date}")
     # fund_etf_hist_em is from East Money
+    df_qfq, df_hfq, df_raw = fetch_concurrently(
+        (ak.fund_etf_hist_em, dict(symbol=symbol, period="daily", start_date=start_date, adjust="qfq")),
+        (ak.fund_etf_hist_em, dict(symbol=symbol, period="daily", start_date=start_date, adjust="hfq")),
+        (ak.fund_etf_hist_em, dict(symbol=symbol, period="daily", start_date=start_date, adjust="")),
+    )
     # 前复权数据
-    df_qfq = ak.fund_etf_hist_em(symbol=symbol, period="daily", start_date=start_date, adjust="qfq")
     if df_qfq is None or df_qfq.empty:
         raise Exception("East Money returned empty qfq data for fund")
-    df_qfq['date'] = pd.to_datetime(df_qfq['日期']).dt.date
-    df_qfq = df_qfq[['date', '开盘', '收盘', '最高', '最低', '成交量']]
-    df_qfq.columns = ['date', 'qfq_open', 'qfq_close', 'qfq_high', 'qfq_low', 'volume']
+    df_qfq = select_columns(df_qfq, '日期', FUND_QFQ_COLUMNS)
 
     # 后复权数据
-    df_hfq = ak.fund_etf_hist_em(symbol=symbol, period="daily", start_date=start_date, adjust="hfq")
     if df_hfq is None or df_hfq.empty:
         raise Exception("East Money returned empty hfq data for fund")
-    df_hfq['date'] = pd.to_datetime(df_hfq['日期']).dt.date
-    df_hfq = df_hfq[['date', '开盘', '收盘', '最高', '最低']]
-    df_hfq.columns = ['date', 'adj_open', 'adj_close', 'adj_high', 'adj_low']
+    df_hfq = select_columns(df_hfq, '日期', EM_HFQ_COLUMNS)
 
     # 不复权数据（基金通常直接用前复权）
-    df_raw = ak.fund_etf_hist_em(symbol=symbol, period="daily", start_date=start_date, adjust="")
     if df_raw is None or df_raw.empty:
         raise Exception("East Money returned empty raw data for fund")
-    df_raw['date'] = pd.to_datetime(df_raw['日期']).dt.date
-    df_raw = df_raw[['date', '开盘', '收盘', '最高', '最低']]
-    df_raw.columns = ['date', 'open', 'close', 'high', 'low']
+    df_raw = select_columns(df_raw, '日期', FUND_RAW_COLUMNS)
 
     # 合并所有数据使用outer join
-    df = pd.merge(df_raw, df_qfq, on='date', how='outer')
-    df = pd.merge(df, df_hfq, on='date', how='outer')
+    df = join_on_date(df_raw, df_qfq, df_hfq)
 
     if df.empty:
         raise Exception("Merged fund data is empty")
@@ -256,85 +414,148 @@ def get_etf_name(symbol: str) -> Optional[str]:
     
     return None
 
-def sync_asset_data(symbol: str, asset_type: str, name: Optional[str] = None, start_date: str = "20000101"):
-    db = SessionLocal()
-    
-    # Fetch stock name if not provided
-    if not name and asset_type == 'stock':
-        try:
-            stock_info = ak.stock_individual_info_em(symbol=symbol)
-            if isinstance(stock_info, pd.DataFrame) and not stock_info.empty:
-                stock_name_row = stock_info[stock_info['item'] == '股票简称']
-                if not stock_name_row.empty:
-                    name = stock_name_row['value'].values[0]
-                    print(f"Found stock name: {name} for symbol {symbol}")
-        except Exception as e:
-            print(f"Failed to fetch stock name for {symbol}: {str(e)}")
-        
-        # If stock API failed, try ETF APIs (for ETF codes)
-        if not name:
-            name = get_etf_name(symbol)
+def lookup_stock_name(symbol: str) -> Optional[str]:
+    """
+    Fetch a stock's name from East Money, falling back to the ETF lists.
+    Results are cached in-process; misses are cached for an hour so a bad symbol
+    is not re-queried on every sync.
+    """
+    cached = _name_cache.get(symbol)
+    if cached and cached[1] > time.time():
+        return cached[0]
+
+    name = None
+    try:
+        stock_info = ak.stock_individual_info_em(symbol=symbol)
+        if isinstance(stock_info, pd.DataFrame) and not stock_info.empty:
+            stock_name_row = stock_info[stock_info['item'] == '股票简称']
+            if not stock_name_row.empty:
+                name = stock_name_row['value'].values[0]
+                print(f"Found stock name: {name} for symbol {symbol}")
+    except Exception as e:
+        print(f"Failed to fetch stock name for {symbol}: {str(e)}")
     
-    # If still no name, use symbol as fallback
-    if not name or not name.strip():
-        name = f"{symbol}"
-        print(f"Using symbol as name for {symbol} (may be ETF or special asset)")
+    # If stock API failed, try ETF APIs (for ETF codes)
+    if not name:
+        name = get_etf_name(symbol)
+
+    _name_cache[symbol] = (name, time.time() + (_NAME_TTL if name else _NAME_MISS_TTL))
+    return name
+
+def sync_asset_data(symbol: str, asset_type: str, name: Optional[str] = None, start_date: Optional[str] = None):
+    """
+    Sync an asset's price history. Without an explicit start_date only new rows are
+    fetched, starting the day before the last stored date.
+    """
+    db = SessionLocal()
     
-    # Check or create asset
+    # Check or create asset. A stored real name is kept as is, so it is only
+    # looked up for new assets or ones still named by their code (placeholder)
     asset = db.query(Asset).filter(Asset.symbol == symbol).first()
-    if not asset:
-        asset = Asset(symbol=symbol, name=name, asset_type=asset_type)
-        db.add(asset)
-        db.commit()
-        db.refresh(asset)
-    elif not asset.name or asset.name == symbol:
-        # Update name if empty or if it's just the symbol code (placeholder)
-        asset.name = name
-        db.commit()
-        print(f"Updated asset name from '{asset.name}' to '{name}' for {symbol}")
+    if not asset or not asset.name or asset.name == symbol:
+        # Fetch stock name if not provided
+        if not name and asset_type == 'stock':
+            name = lookup_stock_name(symbol)
+        
+        # If still no name, use symbol as fallback
+        if not name or not name.strip():
+            name = f"{symbol}"
+            print(f"Using symbol as name for {symbol} (may be ETF or special asset)")
+        
+        if not asset:
+            asset = Asset(symbol=symbol, name=name, asset_type=asset_type)
+            db.add(asset)
+            db.commit()
+            db.refresh(asset)
+        else:
+            asset.name = name
+            db.commit()
+            print(f"Updated asset name from '{asset.name}' to '{name}' for {symbol}")
+    asset_id = asset.id
+
+    # Incremental sync: refetch from just before the last stored day so that day overlaps
+    last_date, last_closes = None, None
+    if start_date is None:
+        last_date = db.query(func.max(PriceHistory.date)).filter(PriceHistory.asset_id == asset_id).scalar()
+        if last_date:
+            last_closes = db.query(PriceHistory.qfq_close, PriceHistory.adj_close).filter(
+                PriceHistory.asset_id == asset_id, PriceHistory.date == last_date).one()
+            start_date = (last_date - timedelta(days=1)).strftime("%Y%m%d")
+        else:
+            start_date = FULL_HISTORY_START
+    # Release the pooled connection while fetching; the session reconnects for the
+    # upsert, and a failed fetch no longer leaves it open (matters for sync_many)
+    db.close()
     
     if asset_type == 'stock':
-        df = get_stock_data(symbol, start_date)
+        fetch = get_stock_data
     elif asset_type == 'fund':
-        df = get_fund_data(symbol, start_date)
+        fetch = get_fund_data
     else:
         print(f"Unsupported asset type: {asset_type}")
-        db.close()
         return
+    df = fetch(symbol, start_date)
 
-    # Bulk insert price history
-    for index, row in df.iterrows():
-        price_record = PriceHistory(
-            asset_id=asset.id,
-            date=row['date'],
-            open=row['open'],
-            high=row['high'],
-            low=row['low'],
-            close=row['close'],
-            # 后复权数据
-            adj_open=row['adj_open'],
-            adj_high=row['adj_high'],
-            adj_low=row['adj_low'],
-            adj_close=row['adj_close'],
-            # 前复权数据
-            qfq_open=row.get('qfq_open'),
-            qfq_high=row.get('qfq_high'),
-            qfq_low=row.get('qfq_low'),
-            qfq_close=row.get('qfq_close'),
-            volume=row['volume']
-        )
-        db.merge(price_record)
-    
+    # 前复权价格以最新价为基准：除权除息后整段历史都会变化。
+    # 后复权以上市日为基准，不应变化；变化说明复权口径不同（Sina 因子 vs East Money 序列）。
+    # If either close moved on the overlapping day, the stored history is stale or on
+    # another basis: refetch all of it so every row shares one adjustment basis
+    if last_closes is not None:
+        overlap = df.loc[df['date'] == pd.Timestamp(last_date), ['qfq_close', 'adj_close']]
+        if not overlap.empty and not all(
+                stored is None or np.isclose(fetched, stored)
+                for fetched, stored in zip(overlap.iloc[0], last_closes)):
+            print(f"  Adjustment changed for {symbol} since {last_date}, refetching full history")
+            invalidate_fetch_cache(symbol)
+            df = fetch(symbol, FULL_HISTORY_START)
+
+    # Bulk upsert price history: one Core INSERT ... ON CONFLICT executed over plain
+    # dicts (executemany), no ORM object per row; re-synced dates overwrite stored prices.
+    # Dates stay datetime64 through fetching and joining; convert to date objects once here
+    records = df.assign(asset_id=asset_id, date=df['date'].dt.date).to_dict(orient="records")
+    table = PriceHistory.__table__
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["asset_id", "date"],
+        set_={c.name: stmt.excluded[c.name] for c in table.columns if c.name not in ("id", "asset_id", "date")},
+    )
     try:
-        db.commit()
+        # One transaction (one commit / WAL sync) for the whole write; rolled back on error
+        with db.begin():
+            db.execute(stmt, records)
         print(f"Successfully synced {len(df)} records for {symbol}")
     except Exception as e:
-        db.rollback()
+        # Re-raise so callers (the sync endpoint, sync_many) don't report a failed write as synced
         print(f"Error syncing {symbol}: {e}")
+        raise
     finally:
         db.close()
+
+def sync_many(symbols: List[Tuple[str, str, Optional[str]]], max_workers: int = 8) -> Dict[str, Optional[str]]:
+    """
+    Sync several (symbol, asset_type, name) assets concurrently.
+    Each task runs sync_asset_data, which opens its own SessionLocal; the work is
+    mostly network and SQLite I/O, so threads overlap well.
+    Returns {symbol: None on success, or the error message}.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sync") as pool:
+        # One task per symbol, so two workers never create the same Asset row
+        unique = {symbol: (asset_type, name) for symbol, asset_type, name in symbols}
+        futures = {pool.submit(sync_asset_data, symbol, asset_type, name): symbol
+                   for symbol, (asset_type, name) in unique.items()}
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                future.result()
+                results[symbol] = None
+            except Exception as e:
+                print(f"Error syncing {symbol}: {e}")
+                results[symbol] = str(e)
+    return results
 
 if __name__ == "__main__":
     init_db()
     # Example sync
     # sync_asset_data("600519", "stock", "贵州茅台")
+    # sync_many([("600519", "stock", "贵州茅台"), ("512890", "fund", None)])